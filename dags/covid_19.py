@@ -1,164 +1,342 @@
 from airflow import DAG
-from datetime import datetime, timedelta
-from airflow.operators.python import PythonOperator
+from datetime import date, datetime, timedelta
+from airflow.decorators import task
+from airflow.exceptions import AirflowSkipException
 from airflow.providers.postgres.operators.postgres import PostgresOperator
 import pandas as pd
-from sqlalchemy import create_engine
+from pgcopy import CopyManager
+import pyarrow.csv as pacsv
+from sqlalchemy import create_engine, text
 from airflow.hooks.base import BaseHook
+import io
 import logging
+import re
+import requests
+from requests.adapters import HTTPAdapter
 
 DEFAULT_DATE = datetime(2020, 1, 22).date()  # First available data date
 
-def extract_data_from_github(ti):
-    """Extracts COVID-19 data from GitHub for the next available date."""
-    conn = BaseHook.get_connection('postgres_conn')
-    engine = create_engine(f"postgresql://{conn.login}:{conn.password}@{conn.host}:{conn.port}/{conn.schema}")
+# How long raw rows stay in stg_covid_raw before the purge task removes them
+STAGING_RETENTION_DAYS = 30
+
+# Upper bound on dates handled per run; must stay below Airflow's default
+# [core] max_map_length (1024) or the mapped expansion fails. A fresh
+# backfill catches up across successive runs instead.
+MAX_DATES_PER_RUN = 1000
+
+# Normalized column layout of the stg_covid_raw staging table (report_date excluded)
+STAGING_COLS = ['fips', 'admin2', 'province_state', 'country_region', 'last_update',
+                'lat', 'long_', 'confirmed', 'deaths', 'recovered', 'active',
+                'incident_rate', 'case_fatality_ratio']
+
+# Measure columns of the fact table
+NUM_COLS = ('confirmed', 'deaths', 'recovered', 'active', 'incident_rate', 'case_fatality_ratio')
+
+# Narrow dtypes for the normalized columns: counts fit in Int32 (nullable, so
+# missing values don't force float64 promotion) and the ratios/coordinates only
+# carry single precision anyway
+DTYPES = {
+    'fips': 'string',
+    'admin2': 'string',
+    'province_state': 'string',
+    'country_region': 'string',
+    'lat': 'float32',
+    'long_': 'float32',
+    'confirmed': 'Int32',
+    'deaths': 'Int32',
+    'recovered': 'Int32',
+    'active': 'Int32',
+    'incident_rate': 'float32',
+    'case_fatality_ratio': 'float32'
+}
+
+
+def _apply_dtypes(df):
+    """Down-casts the columns present in df to their narrow dtypes."""
+    return df.astype({c: t for c, t in DTYPES.items() if c in df.columns})
+
+
+# Known historical header variants, mapped to their standardized names
+ALT_TO_STD = {
+    'province': 'province_state',
+    'state': 'province_state',
+    'country': 'country_region',
+    'latitude': 'lat',
+    'longitude': 'long_',
+    'lng': 'long_'
+}
+
+# Staging columns plus the historical header variants that get renamed to them;
+# anything else in the CSV is skipped by the tokenizer entirely
+NEEDED_RAW_COLS = set(STAGING_COLS) | set(ALT_TO_STD)
+
+# Shared HTTP session with keepalive so backfill loops reuse the TLS connection
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=4))
+
+
+# '+' collapses runs of separators in one substitution, subsuming the old
+# second '__+' pass; note 'Long_' must keep its trailing underscore
+_NON_ALNUM_RX = re.compile('[^a-z0-9]+')
+
+
+def _normalize_column(name):
+    """Normalizes a raw CSV header to the snake_case used internally."""
+    return _NON_ALNUM_RX.sub('_', name.strip().lower())
+
+
+def _wanted_column(name):
+    """Returns True if a raw CSV header normalizes to a column we keep."""
+    return _normalize_column(name) in NEEDED_RAW_COLS
+
+
+def _copy_upsert(cur, df, table, columns, conflict_cols):
+    """COPYs a DataFrame into a temp clone of `table` and upserts from it.
+
+    The ON CONFLICT DO NOTHING dedup happens inside Postgres against the
+    table's unique index, so no existing rows are ever pulled back into
+    Python.
+    """
+    tmp = f"_stg_{table}"
+    col_list = ', '.join(columns)
+    cur.execute(f"CREATE TEMP TABLE {tmp} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP")
+
+    buf = io.StringIO()
+    df[list(columns)].to_csv(buf, index=False, header=False)
+    buf.seek(0)
+    cur.copy_expert(f"COPY {tmp} ({col_list}) FROM STDIN WITH CSV", buf)
+
+    cur.execute(
+        f"INSERT INTO {table} ({col_list}) SELECT {col_list} FROM {tmp} "
+        f"ON CONFLICT ({', '.join(conflict_cols)}) DO NOTHING"
+    )
+
+
+_ENGINE = None
+
+
+def get_engine():
+    """Returns a lazily created, process-wide SQLAlchemy engine.
+
+    Reusing one pooled engine avoids paying TCP/TLS/auth setup on every
+    task invocation; pool_pre_ping revalidates connections that idled
+    between DAG runs.
+    """
+    global _ENGINE
+    if _ENGINE is None:
+        conn = BaseHook.get_connection('postgres_conn')
+        _ENGINE = create_engine(
+            f"postgresql://{conn.login}:{conn.password}@{conn.host}:{conn.port}/{conn.schema}",
+            pool_size=2,
+            pool_pre_ping=True,
+            pool_recycle=1800
+        )
+    return _ENGINE
+
+@task(task_id='get_missing_dates')
+def get_missing_dates():
+    """Lists the report dates between the last loaded date and today."""
+    engine = get_engine()
 
     # Get last processed date from database
     try:
-        result = engine.execute("SELECT MAX(date) FROM dim_date_details;")
+        result = engine.execute(text("SELECT MAX(date) FROM dim_date_details"))
         last_date = result.fetchone()[0]
     except Exception as e:
         logging.error(f"Error querying max date: {e}")
         last_date = None
 
-    current_date = last_date + timedelta(days=1) if last_date else DEFAULT_DATE
+    start_date = last_date + timedelta(days=1) if last_date else DEFAULT_DATE
     today = datetime.today().date()
-
-    while current_date <= today:
-        date_str = current_date.strftime("%m-%d-%Y")
-        url = f'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_daily_reports/{date_str}.csv'
-        logging.info(f"Trying {url}")
-
-        try:
-            df = pd.read_csv(url)
-            # Standardize column names with explicit mappings
-            df.columns = df.columns.str.strip().str.lower().str.replace('[^a-z0-9]', '_', regex=True).str.replace('__+', '_', regex=True)
-
-            # Handle known column name variations from historical data
-            column_mapping = {
-                'province_state': ['province', 'state'],
-                'country_region': ['country'],
-                'lat': ['latitude'],
-                'long_': ['longitude', 'lng']
-            }
-
-            for standard_col, alt_cols in column_mapping.items():
-                for alt in alt_cols:
-                    if alt in df.columns and standard_col not in df.columns:
-                        df.rename(columns={alt: standard_col}, inplace=True)
-
-            ti.xcom_push(key='raw_data', value=df.to_json())
-            logging.info(f"Successfully fetched data for {current_date}")
-            return
-        except Exception as e:
-            logging.warning(f"Failed to fetch {current_date}: {e}")
-            current_date += timedelta(days=1)
-
-    raise ValueError("No new data available up to today's date.")
-
-def transform_data(ti):
-    """Transforms raw data and prepares dimensional models."""
-    raw_data = ti.xcom_pull(task_ids='extract_data', key='raw_data')
-    df = pd.read_json(raw_data)
-
-    # Process last_update to date
-    df['last_update'] = pd.to_datetime(df['last_update']).dt.date
-
-    # Ensure required columns for combined_key
-    required_keys = ['province_state', 'country_region']
-    for col in required_keys:
-        if col not in df.columns:
-            df[col] = df.get(col, '')  # Fallback to empty string
-
-    # Generate combined_key
-    df['combined_key'] = df.apply(
-        lambda row: f"{row.get('admin2', '')}, {row.get('province_state', '')}, {row.get('country_region', '')}".strip(', '),
-        axis=1
+    if start_date > today:
+        raise AirflowSkipException("No new dates to process.")
+
+    missing = [d.isoformat() for d in pd.date_range(start_date, today).date]
+    if len(missing) > MAX_DATES_PER_RUN:
+        logging.info(f"Capping this run to {MAX_DATES_PER_RUN} of {len(missing)} missing dates; "
+                     "later runs will catch up.")
+        missing = missing[:MAX_DATES_PER_RUN]
+    return missing
+
+
+def extract_data_from_github(current_date):
+    """Extracts one day's COVID-19 report from GitHub into the staging table.
+
+    Returns the normalized DataFrame so the transform can run on it in-process.
+    """
+    date_str = current_date.strftime("%m-%d-%Y")
+    url = f'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_daily_reports/{date_str}.csv'
+    logging.info(f"Fetching {url}")
+
+    with SESSION.get(url, stream=True, timeout=(5, 30)) as response:
+        if response.status_code == 404:
+            raise AirflowSkipException(f"No report published for {current_date}.")
+        response.raise_for_status()
+        response.raw.decode_content = True
+        # Arrow's CSV reader parses blocks in parallel, unlike pandas' C engine
+        table = pacsv.read_csv(
+            response.raw,
+            read_options=pacsv.ReadOptions(block_size=1 << 20, use_threads=True)
+        )
+    df = table.to_pandas()
+    df = df[[c for c in df.columns if _wanted_column(c)]]
+
+    # Standardize column names with the precompiled normalizer
+    df.columns = [_normalize_column(c) for c in df.columns]
+
+    # Handle known column name variations from historical data in one rename
+    cols = set(df.columns)
+    renames = {alt: std for alt, std in ALT_TO_STD.items() if alt in cols and std not in cols}
+    if renames:
+        df.rename(columns=renames, inplace=True)
+
+    # Parse last_update here, once per file: each daily report uses a single
+    # timestamp format, so pandas takes its fast inferred path, and the value
+    # is staged as a real timestamp that downstream tasks never reparse
+    if 'last_update' in df.columns:
+        df['last_update'] = pd.to_datetime(df['last_update'], errors='coerce').dt.normalize()
+
+    # Keep a bulk-loaded copy of the raw rows in the staging table for
+    # replayability and ad-hoc inspection
+    df = _apply_dtypes(df.reindex(columns=STAGING_COLS))
+    df.insert(0, 'report_date', current_date)
+    buf = io.StringIO()
+    df.to_csv(buf, index=False, header=False)
+    buf.seek(0)
+
+    raw_conn = get_engine().raw_connection()
+    try:
+        cur = raw_conn.cursor()
+        cur.execute("DELETE FROM stg_covid_raw WHERE report_date = %s", (current_date,))
+        cur.copy_expert(
+            f"COPY stg_covid_raw (report_date, {', '.join(STAGING_COLS)}) FROM STDIN WITH CSV",
+            buf
+        )
+        raw_conn.commit()
+    finally:
+        raw_conn.close()
+
+    logging.info(f"Successfully staged data for {current_date}")
+    return df.drop(columns=['report_date'])
+
+def transform_data(df):
+    """Transforms one report's raw rows and returns the dimensional frames."""
+    # Extract provides the full normalized layout; add anything missing from
+    # ad-hoc inputs in a single consolidation rather than one column at a time
+    missing_cols = [c for c in STAGING_COLS if c not in df.columns]
+    if missing_cols:
+        df = df.assign(**{c: None for c in missing_cols})
+
+    # Generate combined_key with vectorized string ops (no per-row lambda)
+    parts = df[['admin2', 'province_state', 'country_region']].fillna('').astype(str)
+    df['combined_key'] = (
+        (parts['admin2'] + ', ' + parts['province_state'] + ', ' + parts['country_region'])
+        .str.strip(', ')
+        .str.replace(r',\s*,', ',', regex=True)
     )
 
-    # Define numerical columns and fill missing ones
-    num_cols = ['confirmed', 'deaths', 'recovered', 'active', 'incident_rate', 'case_fatality_ratio']
-    for col in num_cols:
-        if col not in df.columns:
-            df[col] = 0
-    df[num_cols] = df[num_cols].fillna(0)
+    # Fill missing measures
+    df[list(NUM_COLS)] = df[list(NUM_COLS)].fillna(0)
 
-    # Create date dimension based on unique last_update dates
-    unique_dates = df['last_update'].unique()
+    # Create date dimension based on unique last_update dates, using the
+    # vectorized DatetimeIndex accessors instead of per-date Python calls
+    idx = pd.DatetimeIndex(pd.unique(df['last_update']))
     dim_date_details = pd.DataFrame({
-        'date': unique_dates,
-        'year': [d.year for d in unique_dates],
-        'month': [d.month for d in unique_dates],
-        'day': [d.day for d in unique_dates],
-        'weekday': [d.strftime("%A") for d in unique_dates],
-        'is_weekend': [d.strftime("%A") in ['Saturday', 'Sunday'] for d in unique_dates]
+        'date': idx.date,
+        'year': idx.year,
+        'month': idx.month,
+        'day': idx.day,
+        'weekday': idx.day_name(),
+        'is_weekend': idx.dayofweek >= 5
     })
 
-    # Ensure required columns exist for the location dimension
-    required_columns = ['fips', 'admin2', 'lat', 'long_']
-    for col in required_columns:
-        if col not in df.columns:
-            df[col] = None
-
-    dim_location_details = df[['fips', 'admin2', 'province_state', 'country_region', 'lat', 'long_', 'combined_key']].drop_duplicates()
+    # combined_key is already the natural key for the location tuple, so
+    # dedup hashes one string column instead of all seven
+    dim_location_details = df.drop_duplicates(subset=['combined_key'])[
+        ['fips', 'admin2', 'province_state', 'country_region', 'lat', 'long_', 'combined_key']
+    ]
 
     # Create fact table using the standardized date
     fact_covid = df[['last_update', 'combined_key', 'confirmed', 'deaths', 'recovered', 'active', 'incident_rate', 'case_fatality_ratio']]
 
-    # Push the transformed data to XCom
-    ti.xcom_push(key='dim_date_details', value=dim_date_details.to_json(date_format='iso'))
-    ti.xcom_push(key='dim_location_details', value=dim_location_details.to_json())
-    ti.xcom_push(key='fact_covid', value=fact_covid.to_json())
+    return dim_date_details, dim_location_details, fact_covid
 
-def load_data_into_postgres(ti):
+def load_data_into_postgres(dim_date_details, dim_location_details, fact_covid):
     """Loads transformed data into PostgreSQL with deduplication."""
-    conn = BaseHook.get_connection('postgres_conn')
-    engine = create_engine(f"postgresql://{conn.login}:{conn.password}@{conn.host}:{conn.port}/{conn.schema}")
-
-    # Pull transformed JSON data from XCom
-    dim_date_json = ti.xcom_pull(task_ids='transform_data', key='dim_date_details')
-    dim_loc_json = ti.xcom_pull(task_ids='transform_data', key='dim_location_details')
-    fact_covid_json = ti.xcom_pull(task_ids='transform_data', key='fact_covid')
-
-    if not (dim_date_json and dim_loc_json and fact_covid_json):
-        raise ValueError("Missing transformed data in XCom.")
-
-    # Convert JSON strings back to DataFrames
-    dim_date_details = pd.read_json(dim_date_json)
-    dim_date_details['date'] = pd.to_datetime(dim_date_details['date']).dt.date
+    engine = get_engine()
 
-    dim_location_details = pd.read_json(dim_loc_json)
-    fact_covid = pd.read_json(fact_covid_json)
-    fact_covid['last_update'] = pd.to_datetime(fact_covid['last_update']).dt.date
-
-    with engine.begin() as connection:
-        # Upsert date dimension
-        existing_dates = pd.read_sql("SELECT date FROM dim_date_details", connection)
-        existing_dates['date'] = pd.to_datetime(existing_dates['date']).dt.date
-        new_dim_date = dim_date_details[~dim_date_details['date'].isin(existing_dates['date'])]
-        if not new_dim_date.empty:
-            new_dim_date.to_sql('dim_date_details', connection, if_exists='append', index=False)
-
-        # Upsert location dimension
-        existing_locations = pd.read_sql("SELECT combined_key FROM dim_location_details", connection)
-        new_dim_location = dim_location_details[~dim_location_details['combined_key'].isin(existing_locations['combined_key'])]
-        if not new_dim_location.empty:
-            new_dim_location.to_sql('dim_location_details', connection, if_exists='append', index=False)
-
-        # Load fact data
-        date_dim = pd.read_sql("SELECT date_id, date FROM dim_date_details", connection)
-        location_dim = pd.read_sql("SELECT location_id, combined_key FROM dim_location_details", connection)
-
-        fact_merged = fact_covid.merge(date_dim, left_on='last_update', right_on='date', how='left')
-        fact_merged = fact_merged.merge(location_dim, on='combined_key', how='left')
-
-        # Drop rows with missing foreign keys
-        fact_final = fact_merged.dropna(subset=['date_id', 'location_id'])
-        fact_final = fact_final[['date_id', 'location_id', 'confirmed', 'deaths', 'recovered', 'active', 'incident_rate', 'case_fatality_ratio']]
+    # Upsert both dimensions via COPY into temp tables; Postgres resolves
+    # the duplicates against the unique indexes
+    raw_conn = engine.raw_connection()
+    try:
+        cur = raw_conn.cursor()
+        _copy_upsert(cur, dim_date_details, 'dim_date_details',
+                     ['date', 'year', 'month', 'day', 'weekday', 'is_weekend'],
+                     ['date'])
+        _copy_upsert(cur, dim_location_details, 'dim_location_details',
+                     ['fips', 'admin2', 'province_state', 'country_region', 'lat', 'long_', 'combined_key'],
+                     ['combined_key'])
+
+        # Load fact data: COPY the natural-key rows into a temp table and
+        # let Postgres resolve the surrogate keys with joins. The inner
+        # joins drop rows without matching dimension entries, as the old
+        # dropna did.
+        cur.execute("""
+            CREATE TEMP TABLE _stg_fact_cases (
+                last_update DATE,
+                combined_key VARCHAR(500),
+                confirmed FLOAT,
+                deaths FLOAT,
+                recovered FLOAT,
+                active FLOAT,
+                incident_rate FLOAT,
+                case_fatality_ratio FLOAT
+            ) ON COMMIT DROP
+        """)
+        # Binary COPY: the numeric measures go over the wire in Postgres'
+        # binary format instead of being rendered to CSV text and re-parsed
+        fact_cols = ['last_update', 'combined_key'] + list(NUM_COLS)
+        fact_rows = fact_covid.assign(last_update=fact_covid['last_update'].dt.date)
+        mgr = CopyManager(raw_conn, '_stg_fact_cases', fact_cols)
+        mgr.copy(fact_rows[fact_cols].itertuples(index=False, name=None))
+        cur.execute("""
+            INSERT INTO fact_cases (date_id, location_id, confirmed, deaths, recovered,
+                                    active, incident_rate, case_fatality_ratio)
+            SELECT DISTINCT ON (d.date_id, l.location_id)
+                   d.date_id, l.location_id, f.confirmed, f.deaths, f.recovered,
+                   f.active, f.incident_rate, f.case_fatality_ratio
+            FROM _stg_fact_cases f
+            JOIN dim_date_details d ON d.date = f.last_update
+            JOIN dim_location_details l ON l.combined_key = f.combined_key
+            ON CONFLICT (date_id, location_id) DO UPDATE SET
+                confirmed = EXCLUDED.confirmed,
+                deaths = EXCLUDED.deaths,
+                recovered = EXCLUDED.recovered,
+                active = EXCLUDED.active,
+                incident_rate = EXCLUDED.incident_rate,
+                case_fatality_ratio = EXCLUDED.case_fatality_ratio
+        """)
+
+        raw_conn.commit()
+    finally:
+        raw_conn.close()
+
+
+@task(task_id='process_report', max_active_tis_per_dag=8)
+def process_report(date_iso):
+    """Runs extract, transform, and load for one report date in a single process.
+
+    Fusing the three steps keeps the DataFrame in one worker's memory, so
+    nothing crosses a task boundary (and XCom) except the date string, and
+    the scheduler's per-task latency is paid once per report instead of
+    three times.
+    """
+    current_date = date.fromisoformat(date_iso)
+    df = extract_data_from_github(current_date)
+    dim_date_details, dim_location_details, fact_covid = transform_data(df)
+    load_data_into_postgres(dim_date_details, dim_location_details, fact_covid)
+    return date_iso
 
-        if not fact_final.empty:
-            fact_final.to_sql('fact_cases', connection, if_exists='append', index=False)
 
 with DAG(
     'Covid19_ETL',
@@ -189,8 +367,8 @@ with DAG(
             admin2 VARCHAR(255),
             province_state VARCHAR(255),
             country_region VARCHAR(255),
-            lat FLOAT,
-            long_ FLOAT,
+            lat REAL,
+            long_ REAL,
             combined_key VARCHAR(500) UNIQUE
         );
 
@@ -202,25 +380,41 @@ with DAG(
             deaths INTEGER,
             recovered INTEGER,
             active INTEGER,
-            incident_rate FLOAT,
-            case_fatality_ratio FLOAT
+            incident_rate REAL,
+            case_fatality_ratio REAL
         );
-        '''
-    )
 
-    extract = PythonOperator(
-        task_id='extract_data',
-        python_callable=extract_data_from_github
-    )
+        CREATE TABLE IF NOT EXISTS stg_covid_raw (
+            report_date DATE NOT NULL,
+            fips TEXT,
+            admin2 TEXT,
+            province_state TEXT,
+            country_region TEXT,
+            last_update TIMESTAMP,
+            lat REAL,
+            long_ REAL,
+            confirmed FLOAT,
+            deaths FLOAT,
+            recovered FLOAT,
+            active FLOAT,
+            incident_rate REAL,
+            case_fatality_ratio REAL
+        );
 
-    transform = PythonOperator(
-        task_id='transform_data',
-        python_callable=transform_data
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_fact_cases ON fact_cases (date_id, location_id);
+        CREATE INDEX IF NOT EXISTS ix_stg_covid_raw_report_date ON stg_covid_raw (report_date);
+        '''
     )
 
-    load = PythonOperator(
-        task_id='load_data',
-        python_callable=load_data_into_postgres
+    # Staged raw rows are only kept for short-term replay and inspection;
+    # purge anything past the retention window so the table stays bounded
+    purge_staging = PostgresOperator(
+        task_id='purge_staging',
+        postgres_conn_id='postgres_conn',
+        sql=f"DELETE FROM stg_covid_raw WHERE report_date < CURRENT_DATE - INTERVAL '{STAGING_RETENTION_DAYS} days';"
     )
 
-    create_tables >> extract >> transform >> load
\ No newline at end of file
+    missing_dates = get_missing_dates()
+    processed = process_report.expand(date_iso=missing_dates)
+
+    create_tables >> purge_staging >> missing_dates >> processed
\ No newline at end of file